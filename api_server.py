@@ -1,17 +1,30 @@
+import io
 import os
 import tempfile
+import shutil
 import time
 import threading
-import uuid
+import copy
+import queue
 import gc
 import psutil
+import orjson
 import requests
 import random
+import socket
+import re
+import math
 from flask import Flask, request, send_file, jsonify
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.exceptions import HTTPException
+from werkzeug.middleware.proxy_fix import ProxyFix
 import yt_dlp
-from pathlib import Path
 import logging
 from functools import wraps
+from urllib.parse import quote, urlsplit
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor, wait as wait_for_futures
+from collections import deque, OrderedDict
 
 # Configure logging for production
 logging.basicConfig(
@@ -21,21 +34,67 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+class OrjsonProvider(DefaultJSONProvider):
+    """jsonify() and request.get_json() through orjson"""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
+
+# Number of reverse proxies in front of the app. Their X-Forwarded-For hops
+# become request.remote_addr, so the rate limiter keys on the real client
+# rather than the proxy. Left at 0 the header is ignored and cannot be spoofed.
+TRUST_PROXY = int(os.environ.get('TRUST_PROXY', '0'))
+if TRUST_PROXY:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUST_PROXY, x_proto=TRUST_PROXY)
 
 # Optimized settings for better iOS app connection
 app.config['MAX_CONTENT_LENGTH'] = 150 * 1024 * 1024  # Increased to 150MB
 app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 300
 
-# Global variables for tracking
-download_status = {}
-download_files = {}
-active_downloads = 0
-MAX_CONCURRENT_DOWNLOADS = 4  # Increased from 2
+MAX_CONCURRENT_DOWNLOADS = 12  # Ceiling for the adaptive limit below
+MIN_CONCURRENT_DOWNLOADS = 1
+INITIAL_CONCURRENT_DOWNLOADS = 4
+
+# Adaptive (AIMD) concurrency: each successful download raises the limit
+# additively, YouTube throttling halves it
+CONCURRENCY_INCREASE = 0.5
+CONCURRENCY_DECREASE = 0.5
+concurrency_limit = float(INITIAL_CONCURRENT_DOWNLOADS)
+concurrency_lock = threading.Lock()
+
+# Retry budget: successes refill it, YouTube throttling drains it. While it
+# is empty requests are refused locally instead of hitting YouTube again,
+# until COOLDOWN_RETRY_AFTER seconds after the last throttle lets a probe out.
+ADAPTIVE_TOKEN_MAX = 10.0
+ADAPTIVE_TOKEN_REFILL = 0.5
+ADAPTIVE_TOKEN_COST = 1.0
+COOLDOWN_RETRY_AFTER = 60
+adaptive_tokens = ADAPTIVE_TOKEN_MAX
+last_throttled_at = 0.0
+
+# Gunicorn workers share one outbound IP, so a worker whose retry budget
+# runs dry touches this file and every worker holds off for the cooldown
+COOLDOWN_MARKER = os.environ.get('YT_COOLDOWN_FILE') or os.path.join(tempfile.gettempdir(), 'yt_cooldown')
+
+# Download admission tokens: taking one is an atomic check-and-increment,
+# unlike reading and bumping a shared counter in two steps
+download_slots = queue.Queue(maxsize=MAX_CONCURRENT_DOWNLOADS)
+for _ in range(MAX_CONCURRENT_DOWNLOADS):
+    download_slots.put_nowait(True)
 
 # Improved rate limiting storage with better cleanup
-rate_limit_storage = {}
+rate_limit_storage = {}  # (scope, client ip) -> deque of request times
+rate_limit_lock = threading.Lock()  # Request threads share the storage
 RATE_LIMIT_CLEANUP_INTERVAL = 300  # Clean every 5 minutes
+# Set APP_RATE_LIMIT=0 when a fronting proxy (e.g. nginx limit_req) already
+# enforces per-client limits, so requests skip the in-process limiter
+RATE_LIMIT_ENABLED = os.environ.get('APP_RATE_LIMIT', '1') != '0'
 
 # Proxy management with better error handling
 current_proxy = None
@@ -44,20 +103,792 @@ PROXY_UPDATE_INTERVAL = 1800  # 30 minutes (more frequent updates)
 proxy_failure_count = 0
 MAX_PROXY_FAILURES = 3
 
+class TTLCache:
+    """Small thread-safe mapping whose entries expire after ttl seconds"""
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # key -> (stored_at, value), oldest first
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """Return the cached value, or None if missing or expired"""
+        entry = self.entries.get(key)
+        if entry and time.time() - entry[0] < self.ttl:
+            return entry[1]
+        return None
+
+    def set(self, key, value):
+        now = time.time()
+        with self.lock:
+            self.entries.pop(key, None)
+            if len(self.entries) >= self.max_entries:
+                self._prune(now)
+            self.entries[key] = (now, value)
+
+    def pop(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def prune(self):
+        """Drop expired entries"""
+        with self.lock:
+            self._prune(time.time())
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def _prune(self, now):
+        for key in [k for k, (stored_at, _) in self.entries.items() if now - stored_at >= self.ttl]:
+            del self.entries[key]
+        # Still full of fresh entries: evict the oldest
+        while len(self.entries) >= self.max_entries:
+            self.entries.popitem(last=False)
+
+# Process-wide DNS cache: yt-dlp resolves the same youtube/googlevideo
+# hosts for every connection it opens. Successful lookups are reused for
+# five minutes; failures are never cached.
+dns_cache = TTLCache(ttl=300, max_entries=1024)
+system_getaddrinfo = socket.getaddrinfo
+
+def cached_getaddrinfo(*args, **kwargs):
+    """socket.getaddrinfo with a TTL cache in front of it"""
+    key = (args, tuple(sorted(kwargs.items())))
+    result = dns_cache.get(key)
+    if result is None:
+        result = system_getaddrinfo(*args, **kwargs)
+        dns_cache.set(key, result)
+    return list(result)
+
+socket.getaddrinfo = cached_getaddrinfo
+
+# Extracted video info keyed by video id, so client retries within a few
+# minutes skip the extractor round trips whichever URL form they use.
+# Info dicts are large, so keep few of them.
+info_cache = TTLCache(ttl=300, max_entries=64)
+
+VIDEO_ID_RE = re.compile(r'(?:[?&]v=|youtu\.be/|/embed/|/shorts/|/live/|/v/)([\w-]{11})(?![\w-])')
+
+# Only links on these domains (or their subdomains) carry a YouTube video id;
+# anything else is passed to yt-dlp unchanged
+YOUTUBE_DOMAINS = ('youtube.com', 'youtu.be', 'youtube-nocookie.com')
+
+def is_youtube_url(url):
+    """True when url points at a YouTube host"""
+    try:
+        host = (urlsplit(url if '//' in url else f"//{url}").hostname or '').lower()
+    except ValueError:
+        return False
+    return any(host == domain or host.endswith(f".{domain}") for domain in YOUTUBE_DOMAINS)
+
+# Playlist and share-tracking query parameters, removed in one pass
+STRIP_PARAMS_RE = re.compile(r'(?<=[?&])(?:list|index|pp|si|feature)=[^&#]*&?')
+
+def clean_youtube_url(url):
+    """Drop playlist and tracking parameters from a YouTube URL; other URLs are returned as is"""
+    if not is_youtube_url(url):
+        return url
+    return STRIP_PARAMS_RE.sub('', url).rstrip('?&')
+
+def extract_video_id(url):
+    """YouTube video id in url, or None (always None for other sites)"""
+    if not is_youtube_url(url):
+        return None
+    match = VIDEO_ID_RE.search(url)
+    return match.group(1) if match else None
+
+def canonical_video_url(video_id):
+    """Plain watch URL for a video id, so every link form extracts the same way"""
+    return f"https://www.youtube.com/watch?v={video_id}"
+
+def video_cache_key(url):
+    """YouTube video id for url, or the URL itself when none is found"""
+    return extract_video_id(url) or url
+
+def get_video_info(ydl, url):
+    """Sanitized extractor info for url, served from info_cache when fresh"""
+    key = video_cache_key(url)
+    info = info_cache.get(key)
+    if info is None:
+        info = ydl.sanitize_info(ydl.extract_info(url, download=False))
+        info_cache.set(key, info)
+    # process_ie_result mutates the dict it is given
+    return copy.deepcopy(info)
+
+# yt-dlp's on-disk cache holds the deciphered player signature functions,
+# so only the first extraction after a player update downloads and runs the
+# player JS. One directory shared by all workers and both option sets.
+YT_DLP_CACHE_DIR = os.environ.get('YT_DLP_CACHE_DIR', '/tmp/yt_dlp_cache')
+
+# Simple, reliable settings for iOS app
+FAST_YDL_OPTS = {
+    'format': 'bestaudio[abr<=160]/bestaudio[ext=m4a]/bestaudio',
+    'outtmpl': 'audio.%(ext)s',  # Pointed at the request's temp dir on checkout
+    'postprocessors': [{
+        'key': 'FFmpegExtractAudio',
+        'preferredcodec': 'mp3',
+        'preferredquality': '4',  # LAME V4 (~165kbps VBR), faster than CBR 160k
+    }],
+    'postprocessor_args': [
+        '-vn',
+        '-ar', '44100',
+        '-ac', '2',
+        '-threads', '2',
+    ],
+    'prefer_ffmpeg': True,
+    'keepvideo': False,
+    'noplaylist': True,
+    
+    # Network settings optimized for reliability
+    'concurrent_fragment_downloads': 3,
+    'http_chunk_size': 10485760,  # 10MB ranged requests
+    'buffersize': 1048576,  # 1MB read buffer
+    'no_color': True,
+    'quiet': True,
+    'no_warnings': True,
+    
+    # More forgiving retry settings
+    'socket_timeout': 20,
+    'fragment_retries': 2,
+    'retries': 2,
+    'extractor_retries': 1,
+    
+    # Skip unnecessary operations
+    'writesubtitles': False,
+    'writeautomaticsub': False,
+    'embed_subs': False,
+    'writeinfojson': False,
+    'writethumbnail': False,
+    'extract_flat': False,
+    'cachedir': YT_DLP_CACHE_DIR,
+}
+
+# Cookie file is resolved once; it only changes on deploy
+COOKIE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cookies.txt')
+if os.path.exists(COOKIE_PATH):
+    FAST_YDL_OPTS['cookiefile'] = COOKIE_PATH
+
+# Opt-in AAC for clients that play m4a natively. FFmpegExtractAudio copies
+# an AAC stream into the m4a container without re-encoding; only non-AAC
+# sources are transcoded.
+M4A_YDL_OPTS = {
+    **FAST_YDL_OPTS,
+    'format': 'bestaudio[ext=m4a]/bestaudio[acodec^=mp4a]/bestaudio',
+    'postprocessors': [{
+        'key': 'FFmpegExtractAudio',
+        'preferredcodec': 'm4a',
+    }],
+    'postprocessor_args': ['-vn'],
+}
+
+# Premium speed-optimized settings
+ULTRAFAST_YDL_OPTS = {
+    'format': 'bestaudio[ext=m4a][abr<=320]/bestaudio[abr<=320]/bestaudio',  # Premium quality
+    'outtmpl': 'audio.%(ext)s',
+    'postprocessors': [{
+        'key': 'FFmpegExtractAudio',
+        'preferredcodec': 'mp3',
+        'preferredquality': '320',  # Maximum MP3 quality
+    }],
+    'postprocessor_args': [
+        '-ar', '48000',              # High sample rate
+        '-ac', '2',                  # Stereo
+        '-b:a', '320k',              # Maximum bitrate
+        '-threads', '0',             # Use all CPU threads
+        '-vn',                       # Never decode a video track
+        '-map_metadata', '-1',       # Strip metadata for speed
+        '-fflags', '+bitexact+fastseek',
+    ],
+    'prefer_ffmpeg': True,
+    'keepvideo': False,
+    'noplaylist': True,
+    
+    # Extreme network performance
+    'concurrent_fragment_downloads': 20,  # Maximum concurrent downloads
+    'http_chunk_size': 10485760,          # 10MB chunks, under YouTube's throttling threshold
+    'buffersize': 1048576,                # 1MB read buffer
+    'no_color': True,
+    'quiet': True,
+    'no_warnings': True,
+    
+    # Zero tolerance for delays
+    'socket_timeout': 25,
+    'fragment_retries': 0,
+    'retries': 0,
+    'extractor_retries': 1,
+    
+    # All speed optimizations
+    'writesubtitles': False,
+    'writeautomaticsub': False,
+    'embed_subs': False,
+    'writeinfojson': False,
+    'writethumbnail': False,
+    'no_check_certificate': True,
+    'cachedir': YT_DLP_CACHE_DIR,
+    'prefer_insecure': True,             # Skip HTTPS when possible
+    
+    # Advanced network optimization
+    'http_headers': {
+        'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+        'Accept-Encoding': 'gzip, deflate, br',
+        'Connection': 'keep-alive',
+        'Accept': '*/*',
+        'Cache-Control': 'no-cache',
+        'Pragma': 'no-cache',
+    }
+}
+
+# aria2c splits each file over several ranged connections, which gets past
+# the per-connection throttling of googlevideo hosts. Used when installed;
+# its connection count (-x/-s) is set per download from FRAGMENT_BUDGET.
+ARIA2C_ARGS = ['-k', '1M', '--file-allocation=none', '--console-log-level=warn']
+USE_ARIA2C = shutil.which('aria2c') is not None
+if USE_ARIA2C:
+    for opts in (FAST_YDL_OPTS, M4A_YDL_OPTS, ULTRAFAST_YDL_OPTS):
+        opts['external_downloader'] = {'default': 'aria2c'}
+
+# Reusable YoutubeDL instances so extractor setup and option parsing
+# happen once per worker instead of on every request
+fast_ydl_pool = queue.Queue()
+m4a_ydl_pool = queue.Queue()
+ultrafast_ydl_pool = queue.Queue()
+
+def build_ydl(opts):
+    """Create a YoutubeDL instance for one of the pools"""
+    ydl = yt_dlp.YoutubeDL(dict(opts))
+    # Import and instantiate the YouTube extractor now rather than on the
+    # first request this instance serves
+    ydl.get_info_extractor('Youtube')
+    return ydl
+
+# Fragment connections shared by all running downloads, so a burst of
+# downloads does not multiply every endpoint's per-download maximum
+FRAGMENT_BUDGET = 24
+
+def fragment_concurrency(opts):
+    """Fragment threads for one more download, split from FRAGMENT_BUDGET"""
+    share = FRAGMENT_BUDGET // max(1, active_download_count())
+    return max(1, min(opts['concurrent_fragment_downloads'], share))
+
+def acquire_ydl(pool, opts, temp_dir=None):
+    """Check out a pooled YoutubeDL (building one if the pool is empty) writing into temp_dir"""
+    try:
+        ydl = pool.get_nowait()
+    except queue.Empty:
+        ydl = build_ydl(opts)
+    if temp_dir:
+        ydl.params['outtmpl']['default'] = os.path.join(temp_dir, 'audio.%(ext)s')
+    connections = fragment_concurrency(opts)
+    ydl.params['concurrent_fragment_downloads'] = connections
+    if USE_ARIA2C:
+        # aria2c opens its own connections per file, so hold it to the same share
+        ydl.params['external_downloader_args'] = {
+            'aria2c': ['-x', str(connections), '-s', str(connections), *ARIA2C_ARGS]
+        }
+    return ydl
+
+def release_ydl(pool, ydl):
+    """Reset per-download state and return a YoutubeDL instance to its pool"""
+    # A failed download leaves the error return code set, and the playlist
+    # bookkeeping would otherwise carry over into the next request
+    ydl._download_retcode = 0
+    ydl._num_downloads = 0
+    ydl._playlist_level = 0
+    ydl._playlist_urls.clear()
+    pool.put(ydl)
+
+# m4a is opt-in, so its pool starts empty and grows on demand
+for _ in range(INITIAL_CONCURRENT_DOWNLOADS):
+    fast_ydl_pool.put(build_ydl(FAST_YDL_OPTS))
+    ultrafast_ydl_pool.put(build_ydl(ULTRAFAST_YDL_OPTS))
+
+# Output formats the fast endpoint accepts: format -> (pool, options, mimetype)
+FAST_AUDIO_FORMATS = {
+    'mp3': (fast_ydl_pool, FAST_YDL_OPTS, 'audio/mpeg'),
+    'm4a': (m4a_ydl_pool, M4A_YDL_OPTS, 'audio/mp4'),
+}
+
+# Working directories are created once and rented out per download, so a
+# request only unlinks the files it produced instead of mkdtemp + rmtree.
+# Scratch files go to /tmp. Set YT_SLOT_ROOT=/dev/shm/yt_slots to keep
+# them in RAM instead; tmpfs pages count against the container's memory
+# limit and are not covered by the /tmp disk check, so only do that on
+# hosts with memory to spare.
+SLOT_ROOT = os.environ.get('YT_SLOT_ROOT') or '/tmp/yt_slots'
+work_dir_pool = queue.Queue()
+
+def create_work_dir():
+    """Create a new pooled working directory"""
+    os.makedirs(SLOT_ROOT, exist_ok=True)
+    return tempfile.mkdtemp(dir=SLOT_ROOT, prefix='slot_')
+
+def acquire_work_dir():
+    """Rent a working directory (creating one if the pool is empty)"""
+    try:
+        return work_dir_pool.get_nowait()
+    except queue.Empty:
+        return create_work_dir()
+
+def release_work_dir(work_dir):
+    """Empty a working directory and return it to the pool"""
+    try:
+        with os.scandir(work_dir) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                else:
+                    os.unlink(entry.path)
+        work_dir_pool.put(work_dir)
+    except OSError as e:
+        logger.error(f"Work dir cleanup error: {e}")
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+for _ in range(INITIAL_CONCURRENT_DOWNLOADS):
+    work_dir_pool.put(create_work_dir())
+
+# Anything other than word characters, spaces and hyphens is dropped from titles
+UNSAFE_TITLE_CHARS = re.compile(r'[^\w \-]')
+
+def clean_title(video_title):
+    """Turn a video title into a safe download filename stem"""
+    safe_title = UNSAFE_TITLE_CHARS.sub('', video_title).strip()
+    safe_title = safe_title[:50]  # Limit to 50 characters
+    return safe_title or "Downloaded Audio"
+
+# Preference order for the fallback lookup, as extension -> rank
+AUDIO_EXTENSIONS = {ext: rank for rank, ext in enumerate(('.mp3', '.m4a', '.webm', '.opus', '.aac', '.ogg'))}
+
+def find_audio_file(directory):
+    """Return (path, size) of the preferred audio file in directory using a single scandir pass"""
+    best_entry, best_rank = None, len(AUDIO_EXTENSIONS)
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            rank = AUDIO_EXTENSIONS.get(os.path.splitext(entry.name)[1].lower(), best_rank)
+            if rank < best_rank:
+                best_entry, best_rank = entry, rank
+    if best_entry is None:
+        return None, 0
+    return best_entry.path, best_entry.stat().st_size
+
+def downloaded_file(info, directory):
+    """(path, size) of the file yt-dlp reported, falling back to scanning directory"""
+    for download in info.get('requested_downloads') or ():
+        file_path = download.get('filepath')
+        if file_path:
+            try:
+                return file_path, os.stat(file_path).st_size
+            except FileNotFoundError:
+                pass
+    return find_audio_file(directory)
+
+# Finished files are kept on disk per video id and output variant, so a
+# repeat request is a plain file send with no YouTube traffic or ffmpeg.
+# Files are named "<video id>.<variant>.<title>.<ext>"; clean_title()
+# output never contains dots. Worker processes share the directory but each
+# keeps its own index: files on disk are adopted at startup, and files other
+# workers store later are picked up on an index miss. The size cap covers
+# the whole directory: eviction rescans it and removes the least recently
+# used files (mtime is bumped on every hit) whichever worker stored them.
+AUDIO_CACHE_DIR = os.environ.get('YT_AUDIO_CACHE_DIR', '/tmp/yt_cache')
+AUDIO_CACHE_MAX_BYTES = int(os.environ.get('YT_AUDIO_CACHE_MB', '500')) * 1024 * 1024
+AUDIO_MIMETYPES = {'.mp3': 'audio/mpeg', '.m4a': 'audio/mp4'}
+# Behind nginx, X_ACCEL_PREFIX names an internal location aliased to
+# AUDIO_CACHE_DIR and cached files are handed over with X-Accel-Redirect.
+# Only path-based sends (the cache) are affected by USE_X_SENDFILE;
+# work-dir responses are file objects.
+X_ACCEL_PREFIX = os.environ.get('X_ACCEL_PREFIX', '').rstrip('/')
+app.config['USE_X_SENDFILE'] = bool(X_ACCEL_PREFIX)
+audio_cache = OrderedDict()  # key -> (path, size), least recently used first
+audio_cache_lock = threading.Lock()
+
+def audio_cache_key(video_id, variant):
+    return f"{video_id}.{variant}"
+
+def add_cached_audio_locked(key, path, size):
+    """Index a cache file; returns the file it replaced for key, if any"""
+    old = audio_cache.pop(key, None)
+    audio_cache[key] = (path, size)
+    if old and old[0] != path:
+        return [old[0]]
+    return []
+
+def scan_audio_cache():
+    """(mtime, key, path, size) for every cache file on disk, any worker's"""
+    found = []
+    with os.scandir(AUDIO_CACHE_DIR) as entries:
+        for entry in entries:
+            parts = entry.name.split('.')
+            if len(parts) == 4 and entry.is_file():
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue  # Evicted by another worker mid-scan
+                found.append((stat.st_mtime, audio_cache_key(parts[0], parts[1]), entry.path, stat.st_size))
+    return found
+
+def trim_audio_cache(max_bytes=None, free_bytes=0, keep=None):
+    """Delete least recently used cache files until the directory holds at
+    most max_bytes (default AUDIO_CACHE_MAX_BYTES) and at least free_bytes
+    were freed; returns bytes freed"""
+    if max_bytes is None:
+        max_bytes = AUDIO_CACHE_MAX_BYTES
+    found = sorted(scan_audio_cache())
+    total = sum(size for _, _, _, size in found)
+    freed = 0
+    for _, key, path, size in found:
+        if total <= max_bytes and freed >= free_bytes:
+            break
+        if path == keep:
+            continue
+        remove_files([path])
+        with audio_cache_lock:
+            if audio_cache.get(key, (None,))[0] == path:
+                del audio_cache[key]
+        total -= size
+        freed += size
+    return freed
+
+def remove_files(paths):
+    for path in paths:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+def store_cached_audio(key, file_path, size, safe_title):
+    """Move a finished download into the cache and return its new path"""
+    ext = os.path.splitext(file_path)[1]
+    path = os.path.join(AUDIO_CACHE_DIR, f"{key}.{safe_title}{ext}")
+    try:
+        os.replace(file_path, path)
+    except OSError:
+        # Work dirs on another filesystem: copy beside the target, then swap
+        # it in atomically so readers never see a partial file
+        partial = f"{path}.part"
+        shutil.copyfile(file_path, partial)
+        os.replace(partial, path)
+    with audio_cache_lock:
+        stale = add_cached_audio_locked(key, path, size)
+    remove_files(stale)
+    trim_audio_cache(keep=path)
+    return path
+
+def drop_cached_audio(key):
+    with audio_cache_lock:
+        audio_cache.pop(key, None)
+
+# Browser/CDN lifetime of GET /audio/<video_id> responses; a cache key
+# always names the same audio, so the ETag is the key itself
+CACHED_AUDIO_MAX_AGE = 86400
+
+def send_cache_file(path, conditional=False):
+    """Send a cache file under the title stored in its name.
+
+    conditional answers If-None-Match and Range from the file (GET only).
+    """
+    name = os.path.basename(path)
+    video_id, variant, title, ext = name.split('.')
+    response = send_file(
+        path,
+        as_attachment=True,
+        download_name=f"{title}.{ext}",
+        mimetype=AUDIO_MIMETYPES.get(f".{ext}", 'application/octet-stream'),
+        conditional=conditional,
+        etag=audio_cache_key(video_id, variant),
+        max_age=CACHED_AUDIO_MAX_AGE if conditional else 0
+    )
+    if conditional:
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+    # Werkzeug leaves X-Sendfile off 304s; those must not hand nginx the file
+    if X_ACCEL_PREFIX and response.status_code != 304 and 'X-Sendfile' in response.headers:
+        del response.headers['X-Sendfile']
+        response.headers['X-Accel-Redirect'] = f"{X_ACCEL_PREFIX}/{quote(name)}"
+    return response
+
+def adopt_cached_audio(key):
+    """Index the newest file on disk for key (stored by another worker), or None"""
+    found = [(mtime, path, size) for mtime, found_key, path, size in scan_audio_cache() if found_key == key]
+    if not found:
+        return None
+    _, path, size = max(found)
+    with audio_cache_lock:
+        add_cached_audio_locked(key, path, size)
+    return path, size
+
+def send_cached_audio(key, conditional=False):
+    """Response for a cached file, or None on a miss"""
+    with audio_cache_lock:
+        entry = audio_cache.get(key)
+        if entry:
+            audio_cache.move_to_end(key)
+    if not entry:
+        # Workers share the directory, so check it before downloading again
+        entry = adopt_cached_audio(key)
+        if not entry:
+            return None
+    try:
+        # mtime doubles as the access time LRU eviction goes by
+        os.utime(entry[0])
+        return send_cache_file(entry[0], conditional)
+    except FileNotFoundError:
+        # Evicted by another worker process
+        drop_cached_audio(key)
+        return None
+
+# Single flight: the first request for a cache key downloads it, identical
+# requests arriving meanwhile wait and are then served from the cache
+inflight_downloads = {}  # cache key -> threading.Event set when done
+inflight_lock = threading.Lock()
+
+def claim_download(key):
+    """True if the caller should download key; otherwise wait for the request already doing so"""
+    with inflight_lock:
+        event = inflight_downloads.get(key)
+        if event is None:
+            inflight_downloads[key] = threading.Event()
+            return True
+    event.wait(DOWNLOAD_TIMEOUT)
+    return False
+
+def release_download_claim(key):
+    """Wake requests waiting on key"""
+    with inflight_lock:
+        event = inflight_downloads.pop(key, None)
+    if event:
+        event.set()
+
+def load_audio_cache():
+    """Create the cache dir and index files left by earlier worker processes"""
+    os.makedirs(AUDIO_CACHE_DIR, exist_ok=True)
+    stale = []
+    with audio_cache_lock:
+        for _, key, path, size in sorted(scan_audio_cache()):
+            stale.extend(add_cached_audio_locked(key, path, size))
+    remove_files(stale)
+    trim_audio_cache()
+
+load_audio_cache()
+
+class Codes:
+    """Machine-readable error codes clients can dispatch on"""
+    INVALID_FORMAT = 'INVALID_FORMAT'
+    MISSING_URL = 'MISSING_URL'
+    INVALID_URL = 'INVALID_URL'
+    UNSUPPORTED_FORMAT = 'UNSUPPORTED_FORMAT'
+    RATE_LIMITED = 'RATE_LIMITED'
+    RESOURCE_LIMIT = 'RESOURCE_LIMIT'
+    YOUTUBE_COOLDOWN = 'YOUTUBE_COOLDOWN'
+    YOUTUBE_RATE_LIMIT = 'YOUTUBE_RATE_LIMIT'
+    YOUTUBE_BLOCKED = 'YOUTUBE_BLOCKED'
+    FORMAT_UNAVAILABLE = 'FORMAT_UNAVAILABLE'
+    VIDEO_UNAVAILABLE = 'VIDEO_UNAVAILABLE'
+    GEO_BLOCKED = 'GEO_BLOCKED'
+    COPYRIGHT_BLOCKED = 'COPYRIGHT_BLOCKED'
+    UPSTREAM_ERROR = 'UPSTREAM_ERROR'
+    NO_OUTPUT_FILE = 'NO_OUTPUT_FILE'
+    DOWNLOAD_TIMEOUT = 'DOWNLOAD_TIMEOUT'
+    DOWNLOAD_FAILED = 'DOWNLOAD_FAILED'
+    INFO_FAILED = 'INFO_FAILED'
+    FILE_TOO_LARGE = 'FILE_TOO_LARGE'
+    NOT_FOUND = 'NOT_FOUND'
+    INTERNAL_ERROR = 'INTERNAL_ERROR'
+
+def error_response(code, message, status, retry_after=None, **extra):
+    """Build the standard error envelope; retry_after also sets Retry-After"""
+    payload = {"error": message, "code": code, **extra}
+    headers = {}
+    if retry_after is not None:
+        payload["retry_after"] = retry_after
+        headers['Retry-After'] = str(retry_after)
+    return jsonify(payload), status, headers
+
+# yt-dlp error classification: one regex pass over the message, then the
+# highest-priority category found picks the client response
+DOWNLOAD_ERROR_RE = re.compile(
+    r'(?P<rate_limited>429|too many requests)'
+    r'|(?P<bot_check>precondition check failed|sign in to confirm)'
+    r'|(?P<no_audio_format>requested format is not available|only images are available)'
+    r'|(?P<unavailable>(?<!service )unavailable|private|deleted|removed)'
+    r'|(?P<geo_blocked>not available in your country|geo|region|blocked in your country)'
+    r'|(?P<copyright>copyright)'
+    r'|(?P<network>timed? ?out|connection reset|connection failed|tunnel|proxy)',
+    re.IGNORECASE
+)
+DOWNLOAD_ERROR_PRIORITY = (
+    'rate_limited', 'bot_check', 'no_audio_format', 'unavailable',
+    'geo_blocked', 'copyright', 'network'
+)
+# Seconds clients are told to wait after YouTube throttles us
+YOUTUBE_RETRY_AFTER = 300
+
+# category -> (code, message, HTTP status, retry_after)
+DOWNLOAD_ERRORS = {
+    'rate_limited': (Codes.YOUTUBE_RATE_LIMIT, "YouTube rate limit exceeded. Please wait a few minutes.", 429, YOUTUBE_RETRY_AFTER),
+    'unavailable': (Codes.VIDEO_UNAVAILABLE, "Video is unavailable, private, or has been removed", 400, None),
+    'geo_blocked': (Codes.GEO_BLOCKED, "Video not available in server region", 400, None),
+    'copyright': (Codes.COPYRIGHT_BLOCKED, "Video blocked due to copyright restrictions", 400, None),
+    'bot_check': (Codes.YOUTUBE_BLOCKED, "YouTube is blocking requests from this server. Please try again later.", 503, YOUTUBE_RETRY_AFTER),
+    'no_audio_format': (Codes.FORMAT_UNAVAILABLE, "No downloadable audio format is available for this video", 400, None),
+    'network': (Codes.UPSTREAM_ERROR, "Could not reach YouTube. Please try again.", 502, None),
+}
+
+# Categories that mean YouTube is pushing back on this server
+THROTTLE_CATEGORIES = {'rate_limited', 'bot_check'}
+
+def classify_download_error(error):
+    """Return the DOWNLOAD_ERRORS category for a yt-dlp error, or None"""
+    found = {match.lastgroup for match in DOWNLOAD_ERROR_RE.finditer(str(error))}
+    return next((category for category in DOWNLOAD_ERROR_PRIORITY if category in found), None)
+
+def parse_retry_after(value):
+    """Whole seconds from a Retry-After value (delay-seconds or HTTP-date), or None"""
+    try:
+        return max(0, int(value))
+    except ValueError:
+        pass
+    try:
+        return max(0, math.ceil(parsedate_to_datetime(value).timestamp() - time.time()))
+    except (TypeError, ValueError):
+        return None
+
+def upstream_retry_after(error):
+    """Retry-After sent with the HTTP error behind a yt-dlp error, or None.
+
+    yt-dlp wraps the HTTP error in DownloadError.exc_info or
+    ExtractorError.cause, so the whole exception chain is searched.
+    """
+    pending, seen = [error], set()
+    while pending:
+        exc = pending.pop()
+        if exc is None or id(exc) in seen:
+            continue
+        seen.add(id(exc))
+        headers = getattr(exc, 'headers', None) or getattr(getattr(exc, 'response', None), 'headers', None)
+        value = headers.get('Retry-After') if hasattr(headers, 'get') else None
+        if value:
+            return parse_retry_after(value)
+        exc_info = getattr(exc, 'exc_info', None)
+        pending.extend([
+            exc_info[1] if isinstance(exc_info, tuple) and len(exc_info) > 1 else None,
+            getattr(exc, 'cause', None), exc.__cause__, exc.__context__
+        ])
+    return None
+
+def download_error_response(category, error):
+    """Error response for a classified download error, preferring YouTube's own Retry-After"""
+    code, message, status, retry_after = DOWNLOAD_ERRORS[category]
+    if retry_after:
+        upstream = upstream_retry_after(error)
+        if upstream:
+            retry_after = upstream
+    return error_response(code, message, status, retry_after)
+
+# Network blips and otherwise unclassified 5xx responses are worth retrying;
+# other categories (rate limits, unavailable videos, ...) fail fast instead
+SERVER_ERROR_RE = re.compile(r'HTTP Error 5\d\d')
+DOWNLOAD_ATTEMPTS = 5
+
+# Decorrelated jitter: each delay is drawn from [base, 3 * previous delay],
+# capped, so concurrent retries spread out instead of firing together
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 30.0
+# An attempt that cannot finish before DOWNLOAD_TIMEOUT only keeps a slot
+# busy after the client got its 504; budget about one socket_timeout plus
+# yt-dlp's own retries for it
+RETRY_MIN_ATTEMPT_TIME = 30.0
+
+def decorrelated_jitter(previous):
+    """Next retry delay after sleeping previous seconds"""
+    return min(RETRY_MAX_DELAY, random.uniform(RETRY_BASE_DELAY, previous * 3))
+
+def is_transient_error(error_message):
+    """True for errors a retry of the same download may get past"""
+    category = classify_download_error(error_message)
+    if category is None:
+        return bool(SERVER_ERROR_RE.search(error_message))
+    return category == 'network'
+
+def download_once(ydl, url):
+    """Extract (or reuse cached info for) url and download it"""
+    info = get_video_info(ydl, url)
+    try:
+        return ydl.process_ie_result(info, download=True)
+    except yt_dlp.utils.DownloadError:
+        # The cached stream URLs may have expired or been rejected; make the
+        # next attempt (or request) extract fresh ones
+        info_cache.pop(video_cache_key(url))
+        raise
+
+def download_with_retry(ydl, url):
+    """Extract and download url, backing off with jitter on transient errors.
+
+    A retry is only started if at least RETRY_MIN_ATTEMPT_TIME is left
+    before the request gives up waiting (DOWNLOAD_TIMEOUT). An attempt that
+    is already running is not interrupted, so a slow one can still finish
+    after the client's 504.
+    """
+    deadline = time.monotonic() + DOWNLOAD_TIMEOUT
+    delay = RETRY_BASE_DELAY
+    for attempt in range(DOWNLOAD_ATTEMPTS):
+        try:
+            return download_once(ydl, url)
+        except Exception as e:
+            error_message = str(e)
+            if attempt == DOWNLOAD_ATTEMPTS - 1 or not is_transient_error(error_message):
+                raise
+            retry_after = upstream_retry_after(e)
+            if retry_after is not None:
+                delay = min(RETRY_MAX_DELAY, retry_after + random.uniform(0, 1))
+            else:
+                delay = decorrelated_jitter(delay)
+            if deadline - time.monotonic() - delay < RETRY_MIN_ATTEMPT_TIME:
+                raise
+            logger.warning(f"Transient download error, retrying in {delay:.1f}s: {error_message[:100]}")
+            time.sleep(delay)
+
+# Downloads run on their own bounded pool so a request can stop waiting after
+# DOWNLOAD_TIMEOUT seconds; admission is still decided by download_slots
+DOWNLOAD_TIMEOUT = 150
+download_executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_DOWNLOADS, thread_name_prefix='ytdl')
+
+def run_download(pool, opts, temp_dir, download, url):
+    """Download job for download_executor; owns its YoutubeDL instance"""
+    ydl = acquire_ydl(pool, opts, temp_dir)
+    try:
+        return download(ydl, url)
+    finally:
+        release_ydl(pool, ydl)
+
+def detach_download(future, temp_dir):
+    """Release a timed-out download's slot and work dir once its job ends"""
+    def release(_):
+        release_download_slot()
+        if temp_dir:
+            release_work_dir(temp_dir)
+    future.add_done_callback(release)
+
 def cleanup_rate_limit_storage():
     """Clean old rate limit entries"""
-    global rate_limit_storage
     now = time.time()
     window = 600  # 10 minutes
     
-    for client_ip in list(rate_limit_storage.keys()):
-        if client_ip in rate_limit_storage:
-            rate_limit_storage[client_ip] = [
-                timestamp for timestamp in rate_limit_storage[client_ip]
-                if now - timestamp < window
-            ]
-            if not rate_limit_storage[client_ip]:
-                del rate_limit_storage[client_ip]
+    with rate_limit_lock:
+        for key, timestamps in list(rate_limit_storage.items()):
+            while timestamps and now - timestamps[0] >= window:
+                timestamps.popleft()
+            if not timestamps:
+                del rate_limit_storage[key]
+
+def rate_limit_client_count():
+    """Distinct clients with recent requests in any rate limit scope"""
+    with rate_limit_lock:
+        return len({client_ip for _, client_ip in rate_limit_storage})
 
 def get_working_proxy():
     """Simplified proxy function - returns None to use direct connection"""
@@ -70,92 +901,205 @@ def test_proxy_comprehensive(proxy_url, timeout=8):
     """Simplified proxy test"""
     return False
 
-def rate_limit(max_requests=15, window=300):  # More generous: 15 requests per 5 minutes
-    """Improved rate limiting with better iOS app support"""
+def rate_limit(max_requests=15, window=300, scope='download'):  # More generous: 15 requests per 5 minutes
+    """Improved rate limiting with better iOS app support.
+
+    Endpoints with the same scope share one budget per client.
+    """
     def decorator(f):
+        if not RATE_LIMIT_ENABLED:
+            return f
+        
         @wraps(f)
         def decorated_function(*args, **kwargs):
             client_ip = request.remote_addr
             now = time.time()
             
-            # Get or create client record
-            if client_ip not in rate_limit_storage:
-                rate_limit_storage[client_ip] = []
-            
-            # Clean old entries for this client
-            rate_limit_storage[client_ip] = [
-                timestamp for timestamp in rate_limit_storage[client_ip]
-                if now - timestamp < window
-            ]
+            with rate_limit_lock:
+                # Get or create client record (oldest request on the left)
+                timestamps = rate_limit_storage.setdefault((scope, client_ip), deque())
+                
+                # Expire old entries for this client
+                while timestamps and now - timestamps[0] >= window:
+                    timestamps.popleft()
+                
+                # Record the request if it fits; only admitted requests are
+                # recorded, so a deque never grows past the largest limit
+                current_requests = len(timestamps)
+                allowed = current_requests < max_requests
+                if allowed:
+                    timestamps.append(now)
             
             # Check rate limit with some tolerance
-            current_requests = len(rate_limit_storage[client_ip])
-            if current_requests >= max_requests:
+            if not allowed:
                 # Add some jitter to avoid thundering herd
                 retry_after = window + random.randint(10, 60)
                 logger.warning(f"Rate limit exceeded for {client_ip}: {current_requests}/{max_requests}")
-                return jsonify({
-                    "error": "Rate limit exceeded. Please wait before trying again.",
-                    "retry_after": retry_after,
-                    "current_requests": current_requests,
-                    "limit": max_requests
-                }), 429
-            
-            # Add current request
-            rate_limit_storage[client_ip].append(now)
+                return error_response(
+                    Codes.RATE_LIMITED, "Rate limit exceeded. Please wait before trying again.", 429,
+                    retry_after=retry_after, current_requests=current_requests, limit=max_requests
+                )
             
             return f(*args, **kwargs)
         return decorated_function
     return decorator
 
+def get_json_body():
+    """The request body as a JSON object (parsed by OrjsonProvider), or None"""
+    data = request.get_json(silent=True)
+    return data if isinstance(data, dict) else None
+
+class WorkDirFile(io.FileIO):
+    """Read-only output file that returns its work dir to the pool on close.
+
+    send_file marks responses as direct passthrough, so the WSGI server
+    closes this file object itself (Response.call_on_close hooks never run)
+    once the body has been sent or the client has gone away.
+    """
+
+    def __init__(self, path, work_dir):
+        super().__init__(path, 'rb')
+        self.work_dir = work_dir
+
+    def close(self):
+        was_open = not self.closed
+        super().close()
+        if was_open:
+            release_work_dir(self.work_dir)
+
+def send_audio(file_path, download_name, file_size, work_dir, mimetype='audio/mpeg'):
+    """Send a finished audio file and release its work dir once the body is sent"""
+    # No ETag/conditional handling and an exact Content-Length keep the
+    # response on the WSGI server's file_wrapper (sendfile) path
+    response = send_file(
+        WorkDirFile(file_path, work_dir),
+        as_attachment=True,
+        download_name=download_name,
+        mimetype=mimetype,
+        conditional=False,
+        etag=False,
+        max_age=0
+    )
+    response.content_length = file_size
+    return response
+
+# psutil readings shared by requests arriving within the same second
+system_stats_cache = TTLCache(ttl=1.0, max_entries=2)
+
+def cached_system_stat(name, read, fresh):
+    """Return a cached psutil reading, re-reading when stale or fresh=True"""
+    value = None if fresh else system_stats_cache.get(name)
+    if value is None:
+        value = read()
+        system_stats_cache.set(name, value)
+    return value
+
+def read_memory_percent(fresh=False):
+    return cached_system_stat('memory', lambda: psutil.virtual_memory().percent, fresh)
+
+def read_tmp_disk_usage(fresh=False):
+    return cached_system_stat('disk', lambda: psutil.disk_usage('/tmp'), fresh)
+
 def check_memory_usage():
     """Less aggressive memory checking"""
     try:
-        memory_percent = psutil.virtual_memory().percent
+        memory_percent = read_memory_percent()
         if memory_percent > 85:  # Increased threshold from 80%
             logger.warning(f"High memory usage: {memory_percent}%")
-            cleanup_old_downloads(force=True)
             gc.collect()
             return True
     except Exception as e:
         logger.error(f"Memory check failed: {e}")
     return False
 
-def cleanup_old_downloads(force=False, max_age=2400):  # Increased to 40 minutes
-    """Less aggressive cleanup"""
+def active_download_count():
+    """Number of downloads currently holding a slot"""
+    return MAX_CONCURRENT_DOWNLOADS - download_slots.qsize()
+
+def current_concurrency_limit():
+    """Number of downloads currently admitted by the adaptive limit"""
+    return int(concurrency_limit)
+
+def acquire_download_slot():
+    """Claim a download slot without blocking; False when the server is full"""
+    with concurrency_lock:
+        if active_download_count() >= current_concurrency_limit():
+            return False
+        try:
+            download_slots.get_nowait()
+            return True
+        except queue.Empty:
+            return False
+
+def release_download_slot():
+    """Give back a slot taken with acquire_download_slot"""
+    download_slots.put_nowait(True)
+
+def record_download_success():
+    """Additive increase of the concurrency limit; refill the retry budget"""
+    global concurrency_limit, adaptive_tokens
+    with concurrency_lock:
+        concurrency_limit = min(MAX_CONCURRENT_DOWNLOADS, concurrency_limit + CONCURRENCY_INCREASE)
+        adaptive_tokens = min(ADAPTIVE_TOKEN_MAX, adaptive_tokens + ADAPTIVE_TOKEN_REFILL)
+
+def record_download_throttled():
+    """Multiplicative decrease of the concurrency limit; drain the retry budget"""
+    global concurrency_limit, adaptive_tokens, last_throttled_at
+    with concurrency_lock:
+        concurrency_limit = max(MIN_CONCURRENT_DOWNLOADS, concurrency_limit * CONCURRENCY_DECREASE)
+        adaptive_tokens = max(0.0, adaptive_tokens - ADAPTIVE_TOKEN_COST)
+        last_throttled_at = time.time()
+        exhausted = adaptive_tokens < ADAPTIVE_TOKEN_COST
+    logger.warning(f"YouTube throttling: concurrency limit lowered to {current_concurrency_limit()}")
+    if exhausted:
+        mark_shared_cooldown()
+
+def mark_shared_cooldown():
+    """Start the cooldown for all worker processes"""
     try:
-        current_time = time.time()
-        to_delete = []
-        
-        for job_id, status_info in download_status.items():
-            age_limit = 600 if force else max_age  # 10 min if forced, 40 min otherwise
-            
-            if current_time - status_info.get('created_at', current_time) > age_limit:
-                to_delete.append(job_id)
-        
-        for job_id in to_delete:
-            cleanup_download(job_id, silent=True)
-        
-        if to_delete:
-            logger.info(f"Cleaned up {len(to_delete)} old downloads")
-            
-    except Exception as e:
-        logger.error(f"Cleanup error: {e}")
+        with open(COOLDOWN_MARKER, 'a'):
+            pass
+        os.utime(COOLDOWN_MARKER)
+    except OSError as e:
+        logger.warning(f"Could not write cooldown marker: {e}")
+
+def shared_cooldown_active():
+    """True while another worker's cooldown marker is fresh"""
+    try:
+        return time.time() - os.stat(COOLDOWN_MARKER).st_mtime < COOLDOWN_RETRY_AFTER
+    except OSError:
+        return False
+
+def youtube_cooling_down():
+    """True while the retry budget is exhausted and the cooldown is running"""
+    if (adaptive_tokens < ADAPTIVE_TOKEN_COST
+            and time.time() - last_throttled_at < COOLDOWN_RETRY_AFTER):
+        return True
+    return shared_cooldown_active()
+
+def cooldown_response():
+    """503 telling the client YouTube is throttling this server"""
+    return error_response(
+        Codes.YOUTUBE_COOLDOWN, "YouTube is throttling this server. Please try again shortly.", 503,
+        retry_after=COOLDOWN_RETRY_AFTER
+    )
+
+def busy_response():
+    """503 for a request that found every download slot taken"""
+    return error_response(
+        Codes.RESOURCE_LIMIT,
+        f"Server busy ({active_download_count()}/{current_concurrency_limit()} downloads active). Try again in a moment.",
+        503
+    )
 
 def check_system_resources():
     """More lenient resource checking"""
-    global active_downloads
-    
-    if active_downloads >= MAX_CONCURRENT_DOWNLOADS:
-        return False, f"Server busy ({active_downloads}/{MAX_CONCURRENT_DOWNLOADS} downloads active). Try again in a moment."
-    
     # Less aggressive memory checking
     try:
-        memory_percent = psutil.virtual_memory().percent
+        memory_percent = read_memory_percent()
         if memory_percent > 90:  # Only fail at 90%
-            cleanup_old_downloads(force=True)
-            time.sleep(1)  # Brief pause for cleanup
-            memory_percent = psutil.virtual_memory().percent
+            gc.collect()
+            memory_percent = read_memory_percent(fresh=True)
             if memory_percent > 95:
                 return False, "Server under heavy load. Please try again in a few minutes."
     except Exception as e:
@@ -163,12 +1107,14 @@ def check_system_resources():
     
     # Less aggressive disk checking
     try:
-        disk_usage = psutil.disk_usage('/tmp')
+        disk_usage = read_tmp_disk_usage()
         free_gb = disk_usage.free / (1024**3)
         if free_gb < 0.3:  # Only fail below 300MB
-            cleanup_old_downloads(force=True)
-            time.sleep(1)
-            disk_usage = psutil.disk_usage('/tmp')
+            # The audio cache is the only thing this server keeps on disk;
+            # evict least recently used files until 300MB would be free
+            freed = trim_audio_cache(free_bytes=int(0.3 * 1024**3) - disk_usage.free)
+            logger.warning(f"Low disk space: {free_gb:.2f}GB free, evicted {freed / 1024**2:.0f}MB of cached audio")
+            disk_usage = read_tmp_disk_usage(fresh=True)
             free_gb = disk_usage.free / (1024**3)
             if free_gb < 0.1:
                 return False, "Insufficient storage space. Please try again later."
@@ -181,22 +1127,23 @@ def check_system_resources():
 def health_check():
     """Enhanced health check"""
     try:
-        memory_percent = psutil.virtual_memory().percent
-        disk_usage = psutil.disk_usage('/tmp')
+        memory_percent = read_memory_percent()
+        disk_usage = read_tmp_disk_usage()
         free_gb = disk_usage.free / (1024**3)
         
         status = {
             "status": "healthy",
             "service": "youtube-audio-downloader",
             "version": "2.0-ios-optimized",
-            "active_downloads": active_downloads,
-            "max_concurrent": MAX_CONCURRENT_DOWNLOADS,
+            "active_downloads": active_download_count(),
+            "max_concurrent": current_concurrency_limit(),
             "memory_usage": f"{memory_percent:.1f}%",
             "free_disk_gb": f"{free_gb:.2f}",
-            "total_jobs": len(download_status),
+            "total_jobs": len(inflight_downloads),
             "proxy_status": "disabled",
-            "rate_limit_clients": len(rate_limit_storage),
-            "uptime": time.time() - start_time if 'start_time' in globals() else 0
+            "ffmpeg": FFMPEG_OK,
+            "rate_limit_clients": rate_limit_client_count(),
+            "uptime": time.time() - start_time
         }
         
         if memory_percent > 95 or free_gb < 0.1:
@@ -212,182 +1159,142 @@ def health_check():
             "error": "health_check_partial_failure"
         }), 200
 
+def download_and_send(youtube_url, ydl_pool, ydl_opts, variant, download, mimetype, ext):
+    """Serve youtube_url as audio: from the cache, or by downloading it with
+    download(ydl, url) on download_executor under a slot and the single-flight
+    claim for (video id, variant)"""
+    video_id = extract_video_id(youtube_url)
+    if video_id:
+        youtube_url = canonical_video_url(video_id)
+    cache_key = video_id and audio_cache_key(video_id, variant)
+    if cache_key:
+        response = send_cached_audio(cache_key)
+        if response:
+            logger.info(f"Serving cached audio for {video_id}")
+            return response
+    
+    if youtube_cooling_down():
+        return cooldown_response()
+    
+    # Identical requests share one download. A follower whose leader failed
+    # re-checks the cooldown and competes to lead the next attempt, so only
+    # one of the waiting requests downloads again.
+    leader = False
+    if cache_key:
+        wait_deadline = time.monotonic() + DOWNLOAD_TIMEOUT
+        while not claim_download(cache_key):
+            response = send_cached_audio(cache_key)
+            if response:
+                return response
+            if youtube_cooling_down():
+                return cooldown_response()
+            if time.monotonic() >= wait_deadline:
+                return error_response(Codes.DOWNLOAD_TIMEOUT, "Download is taking too long. Please try again later.", 504)
+        leader = True
+    
+    if not acquire_download_slot():
+        if leader:
+            release_download_claim(cache_key)
+        return busy_response()
+    slot_held = True
+    temp_dir = None
+    
+    try:
+        # Rent a working directory
+        temp_dir = acquire_work_dir()
+        
+        future = download_executor.submit(run_download, ydl_pool, ydl_opts, temp_dir, download, youtube_url)
+        # Wait separately from future.result(): on 3.11 a TimeoutError raised
+        # inside the job is the same class as the wait timing out
+        if not wait_for_futures([future], timeout=DOWNLOAD_TIMEOUT).done:
+            # The job keeps running and frees its slot and work dir when done
+            logger.warning(f"Download timed out after {DOWNLOAD_TIMEOUT}s: {youtube_url}")
+            detach_download(future, temp_dir)
+            slot_held = False
+            temp_dir = None
+            return error_response(Codes.DOWNLOAD_TIMEOUT, "Download is taking too long. Please try again later.", 504)
+        try:
+            info = future.result()
+            video_title = info.get('title', 'Unknown Video')
+            
+            # Clean the title for filename use
+            safe_title = clean_title(video_title)
+            
+            # Find and return file
+            file_path, file_size = downloaded_file(info, temp_dir)
+            if file_path:
+                logger.info(f"Download successful ({variant}): {file_size} bytes - '{video_title}'")
+                
+                record_download_success()
+                if cache_key:
+                    return send_cache_file(store_cached_audio(cache_key, file_path, file_size, safe_title))
+                response = send_audio(file_path, f"{safe_title}.{ext}", file_size, temp_dir, mimetype)
+                temp_dir = None  # Released by the response once sent
+                return response
+            
+            return error_response(Codes.NO_OUTPUT_FILE, "Download completed but no audio file was created", 500)
+        
+        except Exception as e:
+            # yt-dlp messages can be long; stringify once
+            error_message = str(e)
+            category = classify_download_error(error_message)
+            if category in THROTTLE_CATEGORIES:
+                record_download_throttled()
+            if category:
+                return download_error_response(category, e)
+            logger.error(f"Download failed ({variant}): {error_message}")
+            return error_response(
+                Codes.DOWNLOAD_FAILED, "Download failed due to server error", 500,
+                details=error_message[:200]  # Truncate long error messages
+            )
+    
+    finally:
+        if leader:
+            release_download_claim(cache_key)
+        if slot_held:
+            release_download_slot()
+        # Return the work dir unless the response took ownership of it
+        if temp_dir:
+            release_work_dir(temp_dir)
+
 @app.route('/download/audio/fast', methods=['POST'])
 @rate_limit(max_requests=12, window=300)  # 12 requests per 5 minutes for main endpoint
 def download_audio_fast():
     """Optimized fast download for iOS app"""
-    global active_downloads
-    
     # Quick resource check
     can_proceed, message = check_system_resources()
     if not can_proceed:
         logger.warning(f"Resource check failed: {message}")
-        return jsonify({"error": message, "code": "RESOURCE_LIMIT"}), 503
+        return error_response(Codes.RESOURCE_LIMIT, message, 503)
     
-    if not request.is_json:
-        return jsonify({"error": "Request must be JSON", "code": "INVALID_FORMAT"}), 400
+    data = get_json_body()
+    if data is None:
+        return error_response(Codes.INVALID_FORMAT, "Request must be JSON", 400)
     
-    data = request.json
     youtube_url = data.get('url')
 
     if not youtube_url:
-        return jsonify({"error": "No URL provided", "code": "MISSING_URL"}), 400
+        return error_response(Codes.MISSING_URL, "No URL provided", 400)
+    if not isinstance(youtube_url, str):
+        return error_response(Codes.INVALID_URL, "URL must be a string", 400)
+
+    # raw asks for the native AAC stream without an encode pass; an explicit
+    # format still wins
+    audio_format = data.get('format') or ('m4a' if data.get('raw') else 'mp3')
+    if not isinstance(audio_format, str) or audio_format not in FAST_AUDIO_FORMATS:
+        return error_response(
+            Codes.UNSUPPORTED_FORMAT, f"Unsupported format. Use one of: {', '.join(FAST_AUDIO_FORMATS)}", 400
+        )
+    ydl_pool, ydl_opts, mimetype = FAST_AUDIO_FORMATS[audio_format]
 
     # Clean URL
-    if "&list=" in youtube_url:
-        youtube_url = youtube_url.split("&list=")[0]
+    youtube_url = clean_youtube_url(youtube_url)
     
-    logger.info(f"Fast download request: {youtube_url}")
+    logger.info(f"Fast download request ({audio_format}): {youtube_url}")
     
-    active_downloads += 1
-    temp_dir = None
-    
-    try:
-        # Create temp directory
-        temp_dir = tempfile.mkdtemp(dir='/tmp', prefix='yt_fast_')
-        
-        # Cookie handling
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        cookie_path = os.path.join(script_dir, 'cookies.txt')
-
-        # Simple, reliable settings for iOS app
-        ydl_opts = {
-            'format': 'bestaudio[abr<=160]/bestaudio[ext=m4a]/bestaudio',
-            'outtmpl': os.path.join(temp_dir, 'audio.%(ext)s'),
-            'postprocessors': [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'mp3',
-                'preferredquality': '160',
-            }],
-            'postprocessor_args': [
-                '-ar', '44100',
-                '-ac', '2',
-                '-b:a', '160k',
-                '-threads', '2',
-                '-preset', 'fast',
-            ],
-            'prefer_ffmpeg': True,
-            'keepvideo': False,
-            'noplaylist': True,
-            
-            # Network settings optimized for reliability
-            'concurrent_fragment_downloads': 3,
-            'http_chunk_size': 1048576,  # 1MB chunks
-            'buffer_size': 32768,
-            'no_color': True,
-            'quiet': True,
-            'no_warnings': True,
-            
-            # More forgiving retry settings
-            'socket_timeout': 20,
-            'fragment_retries': 2,
-            'retries': 2,
-            'extractor_retries': 1,
-            
-            # Skip unnecessary operations
-            'writesubtitles': False,
-            'writeautomaticsub': False,
-            'embed_subs': False,
-            'writeinfojson': False,
-            'writethumbnail': False,
-            'extract_flat': False,
-        }
-
-        if os.path.exists(cookie_path):
-            ydl_opts['cookiefile'] = cookie_path
-
-        try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                # Extract video info first to get the title
-                info = ydl.extract_info(youtube_url, download=False)
-                video_title = info.get('title', 'Unknown Video')
-                
-                # Clean the title for filename use
-                safe_title = "".join(c for c in video_title if c.isalnum() or c in (' ', '-', '_')).strip()
-                safe_title = safe_title[:50]  # Limit to 50 characters
-                if not safe_title:
-                    safe_title = "Downloaded Audio"
-                
-                # Download the video
-                ydl.download([youtube_url])
-                
-                # Find and return file
-                for pattern in ['*.mp3', '*.m4a', '*.webm', '*.opus']:
-                    found_files = list(Path(temp_dir).glob(pattern))
-                    if found_files:
-                        file_path = str(found_files[0])
-                        
-                        # Use actual video title for filename
-                        safe_filename = f"{safe_title}.mp3"
-                        
-                        file_size = os.path.getsize(file_path)
-                        logger.info(f"Download successful: {file_size} bytes - '{video_title}'")
-                        
-                        def cleanup_after_send():
-                            time.sleep(45)  # Wait longer before cleanup
-                            try:
-                                import shutil
-                                shutil.rmtree(temp_dir, ignore_errors=True)
-                            except Exception as e:
-                                logger.error(f"Cleanup error: {e}")
-                        
-                        cleanup_thread = threading.Thread(target=cleanup_after_send)
-                        cleanup_thread.daemon = True
-                        cleanup_thread.start()
-                        
-                        return send_file(
-                            file_path, 
-                            as_attachment=True, 
-                            download_name=safe_filename,
-                            mimetype='audio/mpeg'
-                        )
-                
-                return jsonify({
-                    "error": "Download completed but no audio file was created",
-                    "code": "NO_OUTPUT_FILE"
-                }), 500
-        
-        except Exception as e:
-            error_str = str(e).lower()
-            
-            # Handle specific errors
-            if "429" in error_str or "too many requests" in error_str:
-                return jsonify({
-                    "error": "YouTube rate limit exceeded. Please wait a few minutes.",
-                    "code": "YOUTUBE_RATE_LIMIT"
-                }), 429
-            elif any(phrase in error_str for phrase in ["unavailable", "private", "deleted", "removed"]):
-                return jsonify({
-                    "error": "Video is unavailable, private, or has been removed",
-                    "code": "VIDEO_UNAVAILABLE"
-                }), 400
-            elif any(phrase in error_str for phrase in ["not available in your country", "geo", "region", "blocked in your country"]):
-                return jsonify({
-                    "error": "Video not available in server region",
-                    "code": "GEO_BLOCKED"
-                }), 400
-            elif "copyright" in error_str:
-                return jsonify({
-                    "error": "Video blocked due to copyright restrictions",
-                    "code": "COPYRIGHT_BLOCKED"
-                }), 400
-            else:
-                logger.error(f"Download failed: {e}")
-                return jsonify({
-                    "error": "Download failed due to server error",
-                    "code": "DOWNLOAD_FAILED",
-                    "details": str(e)[:200]  # Truncate long error messages
-                }), 500
-    
-    finally:
-        active_downloads -= 1
-        # Cleanup temp directory if still exists
-        if temp_dir:
-            try:
-                import shutil
-                shutil.rmtree(temp_dir, ignore_errors=True)
-            except Exception as e:
-                logger.error(f"Final cleanup error: {e}")
+    return download_and_send(
+        youtube_url, ydl_pool, ydl_opts, audio_format, download_with_retry, mimetype, audio_format
+    )
 
 # Keep compatibility with existing endpoints
 @app.route('/download/audio', methods=['POST'])
@@ -400,288 +1307,193 @@ def download_audio():
 @rate_limit(max_requests=8, window=300)
 def download_audio_ultrafast():
     """Ultra-fast download optimized for speed while maintaining good quality"""
-    global active_downloads
-    
     can_proceed, message = check_system_resources()
     if not can_proceed:
-        return jsonify({"error": message, "code": "RESOURCE_LIMIT"}), 503
+        return error_response(Codes.RESOURCE_LIMIT, message, 503)
     
-    if not request.is_json:
-        return jsonify({"error": "Request must be JSON", "code": "INVALID_FORMAT"}), 400
+    data = get_json_body()
+    if data is None:
+        return error_response(Codes.INVALID_FORMAT, "Request must be JSON", 400)
     
-    data = request.json
     youtube_url = data.get('url')
 
     if not youtube_url:
-        return jsonify({"error": "No URL provided", "code": "MISSING_URL"}), 400
+        return error_response(Codes.MISSING_URL, "No URL provided", 400)
+    if not isinstance(youtube_url, str):
+        return error_response(Codes.INVALID_URL, "URL must be a string", 400)
 
-    if "&list=" in youtube_url:
-        youtube_url = youtube_url.split("&list=")[0]
+    youtube_url = clean_youtube_url(youtube_url)
     
     logger.info(f"Ultra-fast download request: {youtube_url}")
     
-    active_downloads += 1
-    temp_dir = None
+    return download_and_send(
+        youtube_url, ultrafast_ydl_pool, ULTRAFAST_YDL_OPTS, 'ultrafast', download_once, 'audio/mpeg', 'mp3'
+    )
+
+@app.route('/audio/<video_id>', methods=['GET'])
+def cached_audio(video_id):
+    """Cacheable GET for audio already downloaded through the fast endpoint"""
+    audio_format = request.args.get('format', 'mp3')
+    if audio_format not in FAST_AUDIO_FORMATS:
+        return error_response(
+            Codes.UNSUPPORTED_FORMAT, f"Unsupported format. Use one of: {', '.join(FAST_AUDIO_FORMATS)}", 400
+        )
     
-    try:
-        temp_dir = tempfile.mkdtemp(dir='/tmp', prefix='yt_ultra_')
-        
-        # Premium speed-optimized settings
-        ydl_opts = {
-            'format': 'bestaudio[ext=m4a][abr<=320]/bestaudio[abr<=320]/bestaudio',  # Premium quality
-            'outtmpl': os.path.join(temp_dir, 'audio.%(ext)s'),
-            'postprocessors': [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'mp3',
-                'preferredquality': '320',  # Maximum MP3 quality
-            }],
-            'postprocessor_args': [
-                '-ar', '48000',              # High sample rate
-                '-ac', '2',                  # Stereo
-                '-b:a', '320k',              # Maximum bitrate
-                '-threads', '0',             # Use all CPU threads
-                '-preset', 'faster',         # Speed-optimized but high quality
-                '-movflags', '+faststart',
-                '-map_metadata', '-1',       # Strip metadata for speed
-                '-fflags', '+bitexact+fastseek',
-            ],
-            'prefer_ffmpeg': True,
-            'keepvideo': False,
-            'noplaylist': True,
-            
-            # Extreme network performance
-            'concurrent_fragment_downloads': 20,  # Maximum concurrent downloads
-            'http_chunk_size': 16777216,          # 16MB chunks - absolute maximum
-            'buffer_size': 1048576,               # 1MB buffer
-            'no_color': True,
-            'quiet': True,
-            'no_warnings': True,
-            
-            # Zero tolerance for delays
-            'socket_timeout': 25,
-            'fragment_retries': 0,
-            'retries': 0,
-            'extractor_retries': 1,
-            
-            # All speed optimizations
-            'writesubtitles': False,
-            'writeautomaticsub': False,
-            'embed_subs': False,
-            'writeinfojson': False,
-            'writethumbnail': False,
-            'no_check_certificate': True,
-            'prefer_insecure': True,             # Skip HTTPS when possible
-            
-            # Advanced network optimization
-            'http_headers': {
-                'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-                'Accept-Encoding': 'gzip, deflate, br',
-                'Connection': 'keep-alive',
-                'Accept': '*/*',
-                'Cache-Control': 'no-cache',
-                'Pragma': 'no-cache',
-            }
-        }
+    response = send_cached_audio(audio_cache_key(video_id, audio_format), conditional=True)
+    if response is None:
+        return error_response(
+            Codes.NOT_FOUND, "Audio is not cached. Request it with POST /download/audio/fast first.", 404
+        )
+    return response
 
+# Metadata fields returned by /info; the full info dict carries signed
+# stream URLs and is far larger than clients need
+INFO_FIELDS = ('id', 'title', 'duration', 'uploader', 'channel', 'thumbnail', 'webpage_url')
+INFO_MAX_AGE = 3600
+
+@app.route('/info', methods=['GET'])
+@rate_limit(max_requests=20, window=300, scope='info')
+def video_info():
+    """Video metadata without downloading, served from info_cache when fresh"""
+    youtube_url = request.args.get('url')
+    if not youtube_url:
+        return error_response(Codes.MISSING_URL, "No URL provided", 400)
+    
+    youtube_url = clean_youtube_url(youtube_url)
+    video_id = extract_video_id(youtube_url)
+    if video_id:
+        youtube_url = canonical_video_url(video_id)
+    
+    info = info_cache.get(video_cache_key(youtube_url))
+    if info is None:
+        # Extraction is YouTube traffic too: same cooldown, slots and timeout
+        # as a download
+        if youtube_cooling_down():
+            return cooldown_response()
+        if not acquire_download_slot():
+            return busy_response()
+        slot_held = True
         try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                # Extract video info first to get the title
-                info = ydl.extract_info(youtube_url, download=False)
-                video_title = info.get('title', 'Unknown Video')
-                
-                # Clean the title for filename use
-                safe_title = "".join(c for c in video_title if c.isalnum() or c in (' ', '-', '_')).strip()
-                safe_title = safe_title[:50]  # Limit to 50 characters
-                if not safe_title:
-                    safe_title = "Downloaded Audio"
-                
-                # Download the video
-                ydl.download([youtube_url])
-                
-                for pattern in ['*.mp3', '*.m4a', '*.webm', '*.opus']:
-                    found_files = list(Path(temp_dir).glob(pattern))
-                    if found_files:
-                        file_path = str(found_files[0])
-                        
-                        # Use actual video title for filename
-                        safe_filename = f"{safe_title}.mp3"
-                        
-                        file_size = os.path.getsize(file_path)
-                        logger.info(f"Ultra-fast download successful: {file_size} bytes - '{video_title}'")
-                        
-                        def cleanup_after_send():
-                            time.sleep(30)
-                            try:
-                                import shutil
-                                shutil.rmtree(temp_dir, ignore_errors=True)
-                            except Exception as e:
-                                logger.error(f"Cleanup error: {e}")
-                        
-                        cleanup_thread = threading.Thread(target=cleanup_after_send)
-                        cleanup_thread.daemon = True
-                        cleanup_thread.start()
-                        
-                        return send_file(
-                            file_path, 
-                            as_attachment=True, 
-                            download_name=safe_filename,
-                            mimetype='audio/mpeg'
-                        )
-                
-                return jsonify({
-                    "error": "Download completed but no audio file was created",
-                    "code": "NO_OUTPUT_FILE"
-                }), 500
-        
+            future = download_executor.submit(run_download, fast_ydl_pool, FAST_YDL_OPTS, None, get_video_info, youtube_url)
+            if not wait_for_futures([future], timeout=DOWNLOAD_TIMEOUT).done:
+                logger.warning(f"Info extraction timed out after {DOWNLOAD_TIMEOUT}s: {youtube_url}")
+                detach_download(future, None)
+                slot_held = False
+                return error_response(Codes.DOWNLOAD_TIMEOUT, "Reading video information is taking too long. Please try again later.", 504)
+            info = future.result()
         except Exception as e:
-            error_str = str(e).lower()
-            
-            if "429" in error_str or "too many requests" in error_str:
-                return jsonify({
-                    "error": "YouTube rate limit exceeded. Please wait a few minutes.",
-                    "code": "YOUTUBE_RATE_LIMIT"
-                }), 429
-            elif any(phrase in error_str for phrase in ["unavailable", "private", "deleted", "removed"]):
-                return jsonify({
-                    "error": "Video is unavailable, private, or has been removed",
-                    "code": "VIDEO_UNAVAILABLE"
-                }), 400
-            else:
-                logger.error(f"Ultra-fast download failed: {e}")
-                return jsonify({
-                    "error": "Download failed",
-                    "code": "DOWNLOAD_FAILED"
-                }), 500
+            error_message = str(e)
+            category = classify_download_error(error_message)
+            if category in THROTTLE_CATEGORIES:
+                record_download_throttled()
+            if category:
+                return download_error_response(category, e)
+            logger.error(f"Info extraction failed: {error_message}")
+            return error_response(Codes.INFO_FAILED, "Could not read video information", 500)
+        finally:
+            if slot_held:
+                release_download_slot()
     
-    finally:
-        active_downloads -= 1
-        if temp_dir:
-            try:
-                import shutil
-                shutil.rmtree(temp_dir, ignore_errors=True)
-            except Exception as e:
-                logger.error(f"Final cleanup error: {e}")
+    response = jsonify({field: info.get(field) for field in INFO_FIELDS})
+    response.cache_control.public = True
+    response.cache_control.max_age = INFO_MAX_AGE
+    return response
 
 @app.route('/server/stats', methods=['GET'])
 def server_stats():
     """Detailed server statistics for debugging"""
     try:
         return jsonify({
-            "active_downloads": active_downloads,
-            "max_concurrent": MAX_CONCURRENT_DOWNLOADS,
-            "total_jobs": len(download_status),
-            "rate_limit_clients": len(rate_limit_storage),
+            "active_downloads": active_download_count(),
+            "max_concurrent": current_concurrency_limit(),
+            "total_jobs": len(inflight_downloads),
+            "rate_limit_clients": rate_limit_client_count(),
             "proxy_status": "disabled",
-            "memory_percent": psutil.virtual_memory().percent,
-            "disk_free_gb": psutil.disk_usage('/tmp').free / (1024**3),
-            "uptime": time.time() - start_time if 'start_time' in globals() else 0
+            "memory_percent": read_memory_percent(),
+            "disk_free_gb": read_tmp_disk_usage().free / (1024**3),
+            "uptime": time.time() - start_time
         })
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return error_response(Codes.INTERNAL_ERROR, str(e), 500)
 
 def periodic_cleanup():
     """Improved periodic cleanup"""
     while True:
         try:
             time.sleep(300)  # Every 5 minutes
-            cleanup_old_downloads()
             cleanup_rate_limit_storage()
-            gc.collect()
+            # Full collections only under memory pressure
+            check_memory_usage()
             
             # Log periodic stats
-            if len(download_status) > 0:
-                logger.info(f"Periodic cleanup: {len(download_status)} active jobs, {active_downloads} downloads")
+            if active_download_count() > 0:
+                logger.info(f"Periodic cleanup: {len(inflight_downloads)} active jobs, {active_download_count()} downloads")
         except Exception as e:
             logger.error(f"Periodic cleanup error: {e}")
 
 @app.errorhandler(Exception)
 def handle_error(e):
+    # HTTP errors raised by Flask/Werkzeug (416 for a bad Range, 405, ...)
+    # already carry the right status
+    if isinstance(e, HTTPException):
+        return e
     logger.error(f"Unhandled error: {e}")
-    return jsonify({
-        "error": "Internal server error", 
-        "code": "INTERNAL_ERROR"
-    }), 500
+    return error_response(Codes.INTERNAL_ERROR, "Internal server error", 500)
 
 @app.errorhandler(413)
 def handle_file_too_large(e):
-    return jsonify({
-        "error": "File too large",
-        "limit": "150MB maximum",
-        "code": "FILE_TOO_LARGE"
-    }), 413
+    return error_response(Codes.FILE_TOO_LARGE, "File too large", 413, limit="150MB maximum")
 
 @app.errorhandler(404)
 def handle_not_found(e):
-    return jsonify({
-        "error": "Endpoint not found",
-        "code": "NOT_FOUND",
-        "available_endpoints": [
-            "POST /download/audio/fast",
-            "GET /",
-            "GET /server/stats"
-        ]
-    }), 404
-
-def cleanup_download(job_id, silent=False):
-    """Clean up download files and status"""
-    try:
-        if job_id in download_files:
-            file_path = download_files[job_id]
-            if os.path.exists(file_path):
-                parent_dir = os.path.dirname(file_path)
-                import shutil
-                shutil.rmtree(parent_dir, ignore_errors=True)
-            del download_files[job_id]
-        
-        if job_id in download_status:
-            del download_status[job_id]
-            
-        if not silent:
-            logger.info(f"Cleaned up download {job_id}")
-    except Exception as e:
-        if not silent:
-            logger.error(f"Cleanup error for {job_id}: {e}")
+    return error_response(Codes.NOT_FOUND, "Endpoint not found", 404, available_endpoints=[
+        "POST /download/audio/fast",
+        "GET /audio/<video_id>",
+        "GET /info",
+        "GET /",
+        "GET /server/stats"
+    ])
+
+# Process setup runs at import so gunicorn workers get it too
+start_time = time.time()
+
+# Environment optimizations (inherited by the ffmpeg child processes)
+os.environ['FFMPEG_THREADS'] = '2'
+os.environ['MALLOC_ARENA_MAX'] = '2'
+
+# Start background cleanup thread
+cleanup_thread = threading.Thread(target=periodic_cleanup, daemon=True)
+cleanup_thread.start()
+
+# System checks
+FFMPEG_OK = shutil.which('ffmpeg') is not None
+if FFMPEG_OK:
+    logger.info("✓ FFmpeg available")
+else:
+    logger.error("✗ FFmpeg not found")
+
+try:
+    logger.info(f"✓ yt-dlp version: {yt_dlp.version.__version__}")
+except:
+    logger.warning("Could not determine yt-dlp version")
 
 if __name__ == '__main__':
+    # Local development only; deployments run gunicorn -c gunicorn_conf.py
     port = int(os.environ.get('PORT', 8080))
     
-    # Set start time for uptime tracking
-    start_time = time.time()
-    
-    # Environment optimizations
-    os.environ['FFMPEG_THREADS'] = '2'
-    os.environ['MALLOC_ARENA_MAX'] = '2'
-    
-    # Start background cleanup thread
-    cleanup_thread = threading.Thread(target=periodic_cleanup, daemon=True)
-    cleanup_thread.start()
-    
-    # System checks
-    try:
-        import subprocess
-        subprocess.run(['ffmpeg', '-version'], capture_output=True, check=True, text=True)
-        logger.info("✓ FFmpeg available")
-    except (subprocess.CalledProcessError, FileNotFoundError):
-        logger.error("✗ FFmpeg not found")
-    
-    try:
-        logger.info(f"✓ yt-dlp version: {yt_dlp.version.__version__}")
-    except:
-        logger.warning("Could not determine yt-dlp version")
-    
     logger.info("=== YouTube Audio Downloader Server ===")
     logger.info("📱 OPTIMIZED FOR iOS APP CONNECTION")
     logger.info("🚀 Enhanced for Render.com FREE TIER")
     logger.info("")
     logger.info("📱 iOS App Endpoints:")
-    logger.info("- POST /download/audio/fast (main endpoint - 160kbps)")
+    logger.info("- POST /download/audio/fast (main endpoint - ~165kbps VBR)")
     logger.info("- POST /download/audio/ultrafast (fastest - 320kbps)")  
     logger.info("- GET  / (health check)")
     logger.info("- GET  /server/stats (debugging)")
     logger.info("")
     logger.info("⚡ iOS Optimizations:")
     logger.info(f"- Rate limit: 12 requests/5min")
-    logger.info(f"- Max concurrent: {MAX_CONCURRENT_DOWNLOADS}")
+    logger.info(f"- Max concurrent: {INITIAL_CONCURRENT_DOWNLOADS} (adaptive, {MIN_CONCURRENT_DOWNLOADS}-{MAX_CONCURRENT_DOWNLOADS})")
     logger.info("- Better error codes and messages")
     logger.info("- Direct connection (no proxy complications)")
     logger.info("- Less aggressive resource monitoring")
@@ -0,0 +1,17 @@
+import os
+
+# Gunicorn settings for the download API.
+# Downloads are I/O bound (yt-dlp network fetches plus an ffmpeg child
+# process), so a few processes with several threads each keep many
+# downloads in flight. MAX_CONCURRENT_DOWNLOADS and the rate-limit state
+# are per worker process.
+bind = f"0.0.0.0:{os.environ.get('PORT', '8080')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+worker_class = 'gthread'
+threads = 8
+timeout = 180
+keepalive = 5
+# Heartbeat files on tmpfs so a slow disk cannot stall worker checks
+worker_tmp_dir = '/dev/shm'
+max_requests = 1000
+max_requests_jitter = 100
@@ -0,0 +1,43 @@
+import os
+import tempfile
+
+os.environ['YT_AUDIO_CACHE_DIR'] = tempfile.mkdtemp(prefix='yt_cache_test_')
+os.environ['APP_RATE_LIMIT'] = '0'
+
+import api_server  # noqa: E402
+
+VIDEO_ID = 'dQw4w9WgXcQ'
+
+
+def store_cache_file(size=1000):
+    path = os.path.join(api_server.AUDIO_CACHE_DIR, f"{VIDEO_ID}.mp3.Test Title.mp3")
+    with open(path, 'wb') as f:
+        f.write(b'x' * size)
+    api_server.load_audio_cache()
+    return path
+
+
+def test_range_past_end_of_cached_file_is_416():
+    store_cache_file(1000)
+    client = api_server.app.test_client()
+
+    response = client.get(f'/audio/{VIDEO_ID}', headers={'Range': 'bytes=5000-'})
+
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == 'bytes */1000'
+
+
+def test_file_stored_by_another_worker_is_served():
+    api_server.audio_cache.clear()
+    other_video = 'aaaaaaaaaaa'
+    path = os.path.join(api_server.AUDIO_CACHE_DIR, f"{other_video}.mp3.Other.mp3")
+    with open(path, 'wb') as f:
+        f.write(b'y' * 500)
+    client = api_server.app.test_client()
+
+    response = client.get(f'/audio/{other_video}')
+
+    assert response.status_code == 200
+    assert response.data == b'y' * 500
+    assert f"{other_video}.mp3" in api_server.audio_cache
+    response.close()
@@ -0,0 +1,22 @@
+import os
+import tempfile
+
+os.environ.setdefault('YT_AUDIO_CACHE_DIR', tempfile.mkdtemp(prefix='yt_cache_test_'))
+os.environ['APP_RATE_LIMIT'] = '0'
+
+import api_server  # noqa: E402
+
+
+def test_timeout_raised_by_the_job_is_not_a_request_timeout(monkeypatch):
+    def get_video_info(ydl, url):
+        raise TimeoutError('The read operation timed out')
+
+    monkeypatch.setattr(api_server, 'get_video_info', get_video_info)
+    detached = []
+    monkeypatch.setattr(api_server, 'detach_download', lambda *args: detached.append(args))
+    client = api_server.app.test_client()
+
+    response = client.get('/info', query_string={'url': 'https://www.youtube.com/watch?v=bbbbbbbbbbb'})
+
+    assert response.status_code != 504
+    assert not detached
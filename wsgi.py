@@ -1,4 +1,4 @@
-from app import app
+from api_server import app
 
 if __name__ == "__main__":
     app.run()